@@ -1,11 +1,15 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import qrcode
 import os
 import uuid
+import time
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
@@ -28,6 +32,17 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:/
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB default
+app.config['CHANGES_PAGE_SIZE'] = int(os.environ.get('CHANGES_PAGE_SIZE', 500))
+# Long-polling holds a worker thread, so it stays off unless the server runs threaded workers
+app.config['CHANGES_MAX_WAIT'] = float(os.environ.get('CHANGES_MAX_WAIT', 0))  # seconds
+app.config['CHANGES_MAX_WAITERS'] = int(os.environ.get('CHANGES_MAX_WAITERS', 4))
+app.config['CHANGES_POLL_INTERVAL'] = float(os.environ.get('CHANGES_POLL_INTERVAL', 1))  # seconds
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_SALT_LENGTH'] = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+app.config['LOGIN_MAX_ATTEMPTS'] = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 5))
+app.config['LOGIN_LOCKOUT_WINDOW'] = float(os.environ.get('LOGIN_LOCKOUT_WINDOW', 300))  # seconds
+app.config['LOGIN_TRACKED_ACCOUNTS'] = int(os.environ.get('LOGIN_TRACKED_ACCOUNTS', 10000))
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
@@ -57,9 +72,172 @@ class Certificate(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_valid = db.Column(db.Boolean, default=True)
 
+class CertificateChange(db.Model):
+    """Append-only log of certificate events; the id doubles as the feed cursor"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    unique_id = db.Column(db.String(100), nullable=False, index=True)
+    action = db.Column(db.String(20), nullable=False)  # created, status_changed, deleted
+    is_valid = db.Column(db.Boolean)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ChangeSequence(db.Model):
+    """Single-row counter that hands out CertificateChange ids in commit order"""
+    id = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+
+# Wakes long-polling /api/changes requests in this process after a commit.
+# Other worker processes are picked up by the periodic re-query instead.
+changes_condition = threading.Condition()
+# Caps how many requests per process may wait at once, so long-polls can't take every worker thread
+changes_waiters = threading.BoundedSemaphore(max(1, app.config['CHANGES_MAX_WAITERS']))
+
+class CachedUser(UserMixin):
+    """Detached snapshot of a User, safe to share between requests"""
+    def __init__(self, id, username, email, is_admin):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = bool(is_admin)
+    
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.is_admin)
+    
+    def to_dict(self):
+        return {'id': self.id, 'username': self.username, 'email': self.email, 'is_admin': self.is_admin}
+
+# user_id -> (checked_at, CachedUser), shared by the threads of this process
+user_cache = {}
+# user_id -> time of the last invalidation; snapshots checked before it are rejected
+user_invalidated_at = {}
+user_cache_cleared_at = 0.0
+user_cache_lock = threading.Lock()
+
+def _snapshot_is_fresh(user_id, checked_at):
+    """Check a snapshot's age against the TTL and any later invalidation (lock must be held)"""
+    return time.time() - checked_at < app.config['USER_CACHE_TTL'] and \
+        checked_at > max(user_invalidated_at.get(user_id, 0.0), user_cache_cleared_at)
+
+def cache_user(user):
+    """Store a user snapshot in the process cache and the signed session"""
+    snapshot = CachedUser.from_user(user)
+    checked_at = time.time()
+    with user_cache_lock:
+        user_cache[snapshot.id] = (checked_at, snapshot)
+    session['user_snapshot'] = dict(snapshot.to_dict(), checked_at=checked_at)
+    return snapshot
+
+def invalidate_user_cache(user_id=None):
+    """Drop one user (or every user) from the process cache and reject their older session snapshots"""
+    global user_cache_cleared_at
+    with user_cache_lock:
+        if user_id is None:
+            user_cache.clear()
+            user_cache_cleared_at = time.time()
+        else:
+            user_cache.pop(user_id, None)
+            user_invalidated_at[user_id] = time.time()
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    """Remember changed users until commit; invalidating at flush would let another
+    thread re-cache the old row before the change is visible.
+
+    Bulk query.update()/delete() calls skip these events; call
+    invalidate_user_cache() after committing them.
+    """
+    db.object_session(target).info.setdefault('changed_user_ids', set()).add(target.id)
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user_cache(user_id)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_changed_users(session):
+    session.info.pop('changed_user_ids', None)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """Resolve the session user from the process cache, the signed session, or the database"""
+    user_id = int(user_id)
+    with user_cache_lock:
+        cached = user_cache.get(user_id)
+        if cached and _snapshot_is_fresh(user_id, cached[0]):
+            return cached[1]
+        
+        # The session cookie is signed, so a recent snapshot stored at login can be trusted.
+        # It keeps its original checked_at, so caching it never extends its lifetime.
+        snapshot = session.get('user_snapshot')
+        if snapshot and snapshot.get('id') == user_id and \
+                _snapshot_is_fresh(user_id, snapshot.get('checked_at', 0)):
+            user = CachedUser(snapshot['id'], snapshot['username'], snapshot['email'], snapshot['is_admin'])
+            user_cache[user_id] = (snapshot['checked_at'], user)
+            return user
+    
+    user = db.session.get(User, user_id)
+    if user is None:
+        session.pop('user_snapshot', None)
+        return None
+    return cache_user(user)
+
+def hash_password(password):
+    """Hash a password with the configured method and salt length"""
+    return generate_password_hash(
+        password,
+        method=app.config['PASSWORD_HASH_METHOD'],
+        salt_length=app.config['PASSWORD_SALT_LENGTH']
+    )
+
+_password_hash_prefix = None
+
+def password_needs_rehash(password_hash):
+    """Check whether a stored hash was made with different cost parameters than configured"""
+    global _password_hash_prefix
+    if _password_hash_prefix is None:
+        # Let werkzeug expand defaults (e.g. iteration count) once, then reuse the result
+        _password_hash_prefix = generate_password_hash('', method=app.config['PASSWORD_HASH_METHOD'], salt_length=1).split('$', 1)[0]
+    parts = password_hash.split('$')
+    return len(parts) != 3 or parts[0] != _password_hash_prefix or len(parts[1]) != app.config['PASSWORD_SALT_LENGTH']
+
+_dummy_password_hash = None
+
+def dummy_password_hash():
+    """Hash checked for unknown usernames so they cost the same as real accounts"""
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = hash_password(uuid.uuid4().hex)
+    return _dummy_password_hash
+
+# normalized username -> timestamps of recent login attempts, least recently used
+# first, shared by the threads of this process. Unknown usernames are tracked too,
+# so throttling doesn't reveal which accounts exist.
+login_attempts = OrderedDict()
+login_attempts_lock = threading.Lock()
+
+def reserve_login_attempt(username):
+    """Count an attempt against a username before its password is checked; False when throttled"""
+    key = username.strip().lower()
+    now = time.monotonic()
+    with login_attempts_lock:
+        attempts = login_attempts.get(key)
+        if attempts is None:
+            attempts = login_attempts[key] = deque(maxlen=app.config['LOGIN_MAX_ATTEMPTS'])
+        else:
+            login_attempts.move_to_end(key)
+            while attempts and attempts[0] <= now - app.config['LOGIN_LOCKOUT_WINDOW']:
+                attempts.popleft()
+        if len(attempts) >= app.config['LOGIN_MAX_ATTEMPTS']:
+            return False
+        attempts.append(now)
+        while len(login_attempts) > app.config['LOGIN_TRACKED_ACCOUNTS']:
+            login_attempts.popitem(last=False)
+        return True
+
+def reset_login_attempts(username):
+    with login_attempts_lock:
+        login_attempts.pop(username.strip().lower(), None)
 
 def generate_qr_code(data, filename):
     """Generate QR code and save to file"""
@@ -85,6 +263,58 @@ def generate_qr_code(data, filename):
         print(f"❌ Error generating QR code: {e}")
         return None
 
+def record_certificate_change(certificate, action):
+    """Add a change log entry to the current session (committed with the change itself)"""
+    # Bumping the counter row locks it until commit, so concurrent writers take
+    # their ids one after another and a consumer's cursor can never skip past
+    # a change that was still in flight
+    bump = (db.update(ChangeSequence)
+            .where(ChangeSequence.id == 1)
+            .values(last_seq=ChangeSequence.last_seq + 1))
+    if db.session.execute(bump).rowcount == 0:
+        seed_change_sequence()
+        db.session.execute(bump)
+    seq = db.session.execute(db.select(ChangeSequence.last_seq).where(ChangeSequence.id == 1)).scalar_one()
+    db.session.add(CertificateChange(
+        id=seq,
+        unique_id=certificate.unique_id,
+        action=action,
+        is_valid=None if action == 'deleted' else certificate.is_valid
+    ))
+
+def seed_change_sequence():
+    """Create the change_sequence row if it is missing, continuing after any existing entries"""
+    if db.session.get(ChangeSequence, 1):
+        return
+    last_seq = db.session.query(db.func.max(CertificateChange.id)).scalar() or 0
+    try:
+        with db.session.begin_nested():
+            db.session.add(ChangeSequence(id=1, last_seq=last_seq))
+    except IntegrityError:
+        pass  # Another worker seeded it first
+
+def current_change_cursor():
+    """Latest committed change sequence number, i.e. the `since` to start following the feed from"""
+    return db.session.execute(db.select(ChangeSequence.last_seq).where(ChangeSequence.id == 1)).scalar() or 0
+
+def notify_certificate_changes():
+    """Wake up any long-polling change feed requests"""
+    with changes_condition:
+        changes_condition.notify_all()
+
+def serialize_certificate(certificate):
+    """Convert a certificate to its JSON API representation"""
+    return {
+        'id': certificate.id,
+        'unique_id': certificate.unique_id,
+        'holder_name': certificate.holder_name,
+        'course_name': certificate.course_name,
+        'issue_date': certificate.issue_date.strftime('%Y-%m-%d'),
+        'issuer_name': certificate.issuer_name,
+        'verification_url': certificate.verification_url,
+        'is_valid': certificate.is_valid
+    }
+
 def get_qr_code_path(unique_id):
     """Get the path to a QR code file for a certificate"""
     qr_filename = f"qr_{unique_id}.png"
@@ -334,10 +564,24 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        
+        # Reserve the attempt before hashing so a burst can't run more than
+        # LOGIN_MAX_ATTEMPTS hashes per username
+        if not reserve_login_attempt(username):
+            flash('Too many failed login attempts. Please try again later.')
+            return render_template('login.html'), 429
+        
         user = User.query.filter_by(username=username).first()
+        # Unknown usernames still pay for a hash, so timing doesn't reveal them
+        password_ok = check_password_hash(user.password_hash if user else dummy_password_hash(), password)
         
-        if user and check_password_hash(user.password_hash, password):
+        if user and password_ok:
+            reset_login_attempts(username)
+            if password_needs_rehash(user.password_hash):
+                user.password_hash = hash_password(password)
+                db.session.commit()
             login_user(user)
+            cache_user(user)
             return redirect(url_for('admin_dashboard'))
         else:
             flash('Invalid username or password')
@@ -348,6 +592,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    session.pop('user_snapshot', None)
     return redirect(url_for('index'))
 
 @app.route('/admin/dashboard')
@@ -399,11 +644,14 @@ def create_certificate():
             issue_date=issue_date,
             issuer_name=issuer_name,
             issuer_logo=issuer_logo,
-            verification_url=verification_url
+            verification_url=verification_url,
+            is_valid=True
         )
         
         db.session.add(certificate)
+        record_certificate_change(certificate, 'created')
         db.session.commit()
+        notify_certificate_changes()
         
         # Generate PDF
         pdf_buffer = generate_certificate_pdf(certificate)
@@ -440,17 +688,69 @@ def api_certificates():
     if not current_user.is_admin:
         return jsonify({'error': 'Access denied'}), 403
     
+    # Read the cursor before the rows: changes committed in between are replayed, never missed
+    cursor = current_change_cursor()
     certificates = Certificate.query.all()
-    return jsonify([{
-        'id': c.id,
-        'unique_id': c.unique_id,
-        'holder_name': c.holder_name,
-        'course_name': c.course_name,
-        'issue_date': c.issue_date.strftime('%Y-%m-%d'),
-        'issuer_name': c.issuer_name,
-        'verification_url': c.verification_url,
-        'is_valid': c.is_valid
-    } for c in certificates])
+    response = jsonify([serialize_certificate(c) for c in certificates])
+    response.headers['X-Changes-Cursor'] = str(cursor)
+    return response
+
+@app.route('/api/changes')
+@login_required
+def api_changes():
+    """Incremental change feed; long-polls for up to `wait` seconds when there is nothing new"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        since = int(request.args.get('since', 0))
+        wait = float(request.args.get('wait', 0))
+        limit = int(request.args.get('limit', app.config['CHANGES_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'error': 'since, wait and limit must be numeric'}), 400
+    
+    limit = max(1, min(limit, app.config['CHANGES_PAGE_SIZE']))
+    wait = max(0.0, min(wait, app.config['CHANGES_MAX_WAIT']))
+    # When all waiting slots are taken, answer immediately instead of holding another thread
+    waiting = wait > 0 and changes_waiters.acquire(blocking=False)
+    deadline = time.monotonic() + (wait if waiting else 0)
+    
+    try:
+        while True:
+            changes = (CertificateChange.query
+                       .filter(CertificateChange.id > since)
+                       .order_by(CertificateChange.id)
+                       .limit(limit)
+                       .all())
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                break
+            # End the read transaction so the next query sees rows committed meanwhile
+            db.session.rollback()
+            with changes_condition:
+                changes_condition.wait(min(remaining, app.config['CHANGES_POLL_INTERVAL']))
+    finally:
+        if waiting:
+            changes_waiters.release()
+    
+    # Attach the current state of each certificate still present
+    unique_ids = {change.unique_id for change in changes}
+    certificates = {}
+    if unique_ids:
+        certificates = {c.unique_id: c for c in Certificate.query.filter(Certificate.unique_id.in_(unique_ids))}
+    
+    return jsonify({
+        'changes': [{
+            'seq': change.id,
+            'unique_id': change.unique_id,
+            'action': change.action,
+            'is_valid': change.is_valid,
+            'created_at': change.created_at.isoformat(),
+            'certificate': serialize_certificate(certificates[change.unique_id]) if change.unique_id in certificates else None
+        } for change in changes],
+        'cursor': changes[-1].id if changes else since,
+        'has_more': len(changes) == limit
+    })
 
 @app.route('/admin/delete_certificate/<unique_id>', methods=['POST'])
 @login_required
@@ -474,7 +774,9 @@ def delete_certificate(unique_id):
             
             # Delete the certificate from database
             db.session.delete(certificate)
+            record_certificate_change(certificate, 'deleted')
             db.session.commit()
+            notify_certificate_changes()
             flash(f'Certificate for {certificate.holder_name} (ID: {unique_id}) deleted successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -586,7 +888,9 @@ def toggle_certificate_status(unique_id):
         try:
             # Toggle the status
             certificate.is_valid = not certificate.is_valid
+            record_certificate_change(certificate, 'status_changed')
             db.session.commit()
+            notify_certificate_changes()
             
             status_text = "valid" if certificate.is_valid else "invalid"
             flash(f'Certificate for {certificate.holder_name} (ID: {unique_id}) marked as {status_text}!', 'success')
@@ -611,7 +915,7 @@ def init_app():
                 admin_user = User(
                     username='admin',
                     email='admin@example.com',
-                    password_hash=generate_password_hash('admin123'),
+                    password_hash=hash_password('admin123'),
                     is_admin=True
                 )
                 db.session.add(admin_user)
@@ -619,6 +923,18 @@ def init_app():
                 print("✅ Admin user created successfully")
         except Exception as e:
             print(f"❌ Error initializing app: {e}")
+        
+        # Build the unknown-user hash now so the first such login isn't measurably slower
+        dummy_password_hash()
+        
+        # Seeded separately so a failure here doesn't hide the admin user setup;
+        # record_certificate_change also recreates the row if it is missing
+        try:
+            seed_change_sequence()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error seeding change sequence: {e}")
 
 if __name__ == '__main__':
     init_app()